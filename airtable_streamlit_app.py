@@ -1,7 +1,20 @@
 import streamlit as st
 import pandas as pd
 import requests
+import requests_cache
 import datetime
+import io
+import threading
+import time
+import orjson
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Copy-on-Write is always on from pandas 3, where the option is deprecated
+if int(pd.__version__.split(".")[0]) < 3:
+    pd.set_option("mode.copy_on_write", True)
 
 # Airtable configuration
 AIRTABLE_BASE_ID = st.secrets.get("AIRTABLE_BASE_ID", "your_base_id")
@@ -10,92 +23,361 @@ AIRTABLE_API_KEY = st.secrets.get("AIRTABLE_API_KEY", "your_api_key")
 
 AIRTABLE_ENDPOINT = f"https://api.airtable.com/v0/{AIRTABLE_BASE_ID}/{AIRTABLE_TABLE_NAME}"
 
+_AUTH = f"Bearer {AIRTABLE_API_KEY}"
+_JSON_HEADERS = MappingProxyType({
+    "Authorization": _AUTH,
+    "Content-Type": "application/json"
+})
+
+# "0"/"1" single-select fields stored as nullable int8, enum fields as categories
+_RESISTANCE_FIELDS = ["CR", "BLBLI_R", "FQR", "GC3_R"]
+_BINARY_FIELDS = ["Rectal_CPE_Pos", "CHF", "CKD", "Tumor", "Diabetes", "Immunosuppressed"] + _RESISTANCE_FIELDS
+_CATEGORY_FIELDS = ["Gender", "Species", "Setting", "Acquisition", "BSI_Source"]
+
+# How long fetched records are reused before going back to Airtable (seconds)
+_CACHE_TTL = 60
+# (connect, read) timeout for Airtable page reads and writes (seconds)
+_REQUEST_TIMEOUT = (5, 15)
+# How old a cached response may be when Airtable is unreachable (seconds)
+_OFFLINE_MAX_STALE = 24 * 60 * 60
+
+# Frame versions kept by the summary/export caches (each add creates a new one)
+_DERIVED_CACHE_ENTRIES = 4
+
+# Form select-box options
+_BINARY = ("0", "1")
+_GENDER = ("Male", "Female")
+_SPECIES = ("E. coli", "Klebsiella spp.", "Proteus spp.", "Pseudomonas spp.", "Acinetobacter spp.")
+_SETTING = ("ICU", "Internal Medicine")
+_ACQUISITION = ("Community", "Hospital")
+_BSI_SOURCE = ("Primary", "Lung", "Abdomen", "UTI")
+
+# HTTP session
+# Airtable allows 5 requests/second per base
+_MAX_REQUESTS_PER_SECOND = 5
+
+class _WriteSafeRetry(Retry):
+    """Retry that also retries 429 on POST/PATCH: a rate-limited write was never applied"""
+    def is_retry(self, method, status_code, has_retry_after=False):
+        if status_code == 429:
+            return True
+        return super().is_retry(method, status_code, has_retry_after)
+
+class _ThrottledAdapter(HTTPAdapter):
+    """HTTPAdapter that spaces outgoing requests to stay under the rate limit"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+    
+    def send(self, request, **kwargs):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + 1 / _MAX_REQUESTS_PER_SECOND
+        time.sleep(slot - now)
+        return super().send(request, **kwargs)
+
+@st.cache_resource
+def _get_session():
+    """Shared HTTP session, built once per process so it survives reruns.
+    
+    Keep-alive + connection pooling, rate limiting, retries with backoff, and
+    an on-disk cache of GET responses (cache hits never reach the adapter).
+    """
+    session = requests_cache.CachedSession(
+        cache_name="airtable_cache",
+        backend="sqlite",
+        expire_after=_CACHE_TTL,
+        allowable_methods=["GET"]
+    )
+    session.headers.update(_JSON_HEADERS)
+    session.mount("https://", _ThrottledAdapter(
+        pool_connections=10,
+        pool_maxsize=10,
+        max_retries=_WriteSafeRetry(
+            total=3,
+            backoff_factor=0.3,
+            status_forcelist=[429, 500, 502, 503, 504],
+            raise_on_status=False
+        )
+    ))
+    return session
+
+# DataFrame and export helpers
+def _apply_dtypes(df):
+    """Convert binary fields to Int8 and enum fields to category"""
+    for col in _BINARY_FIELDS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors="coerce").astype("Int8")
+    for col in _CATEGORY_FIELDS:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+    return df
+
+def _page_to_frame(records):
+    """Flatten one page of records: "fields.<name>" columns plus the record id"""
+    if not records:
+        return pd.DataFrame(columns=["airtable_id"])
+    df = pd.json_normalize(records, max_level=1)
+    df = df.drop(columns="createdTime", errors="ignore")
+    df.columns = df.columns.str.removeprefix("fields.")
+    return df.rename(columns={"id": "airtable_id"})
+
+def _frame_key(df):
+    """Content key for caching results derived from a records DataFrame.
+    
+    st.cache_data only hashes a sample of large frames, so an edit to an
+    unsampled row could otherwise return stale cached results.
+    """
+    return len(df), tuple(df.columns), int(pd.util.hash_pandas_object(df, index=False).sum())
+
+@st.cache_data(max_entries=_DERIVED_CACHE_ENTRIES, show_spinner=False)
+def _summarize_records(_df, df_key):
+    """Gender counts and resistance totals for the View Data tab (cached on df_key)"""
+    summary = {}
+    if 'Gender' in _df.columns:
+        gender_counts = _df['Gender'].value_counts()
+        summary["male_count"] = int(gender_counts.get('Male', 0))
+        summary["female_count"] = int(gender_counts.get('Female', 0))
+    
+    available_cols = [col for col in _RESISTANCE_FIELDS if col in _df.columns]
+    if available_cols:
+        summary["resistance"] = _df[available_cols].sum().rename("count")
+    return summary
+
+@st.cache_data(max_entries=_DERIVED_CACHE_ENTRIES, show_spinner=False)
+def _df_to_csv_bytes(_df, df_key):
+    """Serialize records to CSV bytes (cached on df_key)"""
+    return _df.to_csv(index=False).encode("utf-8")
+
+@st.cache_data(max_entries=_DERIVED_CACHE_ENTRIES, show_spinner=False)
+def _df_to_parquet_bytes(_df, df_key):
+    """Serialize records to zstd-compressed Parquet bytes (cached on df_key)"""
+    buffer = io.BytesIO()
+    _df.to_parquet(buffer, index=False, compression="zstd")
+    return buffer.getvalue()
+
 # Airtable API functions
-def add_record_to_airtable(record_data):
-    """Add record to Airtable"""
-    headers = {
-        "Authorization": f"Bearer {AIRTABLE_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    
-    data = {
-        "records": [
-            {
-                "fields": record_data
-            }
-        ]
-    }
+def _get_page(session, params):
+    """GET one page of records, falling back to a stale cached copy only if
+    Airtable is unreachable or times out (API errors such as 401/404 are
+    never masked). Returns (response, served from the stale fallback)."""
+    try:
+        return session.get(AIRTABLE_ENDPOINT, params=params, timeout=_REQUEST_TIMEOUT), False
+    except (requests.ConnectionError, requests.Timeout):
+        response = session.get(
+            AIRTABLE_ENDPOINT,
+            params=params,
+            only_if_cached=True,
+            headers={"Cache-Control": f"max-stale={_OFFLINE_MAX_STALE}"}
+        )
+        if response.status_code == 504:
+            raise
+        return response, True
+
+def _response_time(response):
+    """When a response was fetched from Airtable (kept on disk cache hits)"""
+    created_at = getattr(response, "created_at", None)
+    if created_at is None:
+        return time.time()
+    if created_at.tzinfo is None:
+        # Older requests-cache releases store naive UTC datetimes
+        created_at = created_at.replace(tzinfo=datetime.timezone.utc)
+    return created_at.timestamp()
+
+@st.cache_data(ttl=_CACHE_TTL, show_spinner=False)
+def _fetch_records():
+    """Fetch all records as (DataFrame, fetch timestamp, from stale fallback)
+    (cached; raises on API errors)
+    
+    The timestamp is that of the oldest page, so callers can tell how old the
+    data really is whichever cache layer it came from.
+    """
+    # Airtable returns at most 100 records per page; follow the offset cursor.
+    # Each page is flattened as it arrives so the raw JSON can be released.
+    session = _get_session()
+    frames = []
+    fetched_at = time.time()
+    from_stale = False
+    params = {"pageSize": 100}
+    while True:
+        response, page_stale = _get_page(session, params)
+        response.raise_for_status()
+        from_stale = from_stale or page_stale
+        fetched_at = min(fetched_at, _response_time(response))
+        page = orjson.loads(response.content)
+        frames.append(_page_to_frame(page["records"]))
+        if "offset" not in page:
+            break
+        params["offset"] = page["offset"]
+    
+    return _apply_dtypes(pd.concat(frames, ignore_index=True)), fetched_at, from_stale
+
+def get_records_from_airtable():
+    """Get all records from Airtable, reusing this session's copy while fresh"""
+    df = st.session_state.get("cached_df")
+    if df is not None and time.time() - st.session_state["cached_df_at"] < _CACHE_TTL:
+        return df
     
     try:
-        response = requests.post(AIRTABLE_ENDPOINT, json=data, headers=headers)
-        if response.status_code == 200:
-            return response.json()["records"][0]["id"]
-        else:
-            st.error(f"Airtable API error: {response.text}")
-            return None
+        df, fetched_at, from_stale = _fetch_records()
+        if not from_stale and time.time() - fetched_at >= _CACHE_TTL:
+            # The in-memory entry was built from an already-aged disk cache hit
+            _fetch_records.clear()
+            df, fetched_at, from_stale = _fetch_records()
+        st.session_state["cached_df"] = df
+        # An offline fallback is always older than the TTL; keep it for one
+        # TTL from now rather than retrying Airtable on every rerun
+        st.session_state["cached_df_at"] = time.time() if from_stale else fetched_at
+        return df
+    except requests.HTTPError as e:
+        st.error(f"Airtable API error: {e.response.text}")
+        return pd.DataFrame()
     except Exception as e:
         st.error(f"Error: {e}")
-        return None
+        return pd.DataFrame()
 
-def get_records_from_airtable():
-    """Get all records from Airtable"""
-    headers = {
-        "Authorization": f"Bearer {AIRTABLE_API_KEY}"
-    }
-    
+def ping_airtable():
+    """Check credentials with a one-record, one-field request"""
     try:
-        response = requests.get(AIRTABLE_ENDPOINT, headers=headers)
-        if response.status_code == 200:
-            records = response.json()["records"]
-            # Flatten the structure
-            flattened_records = []
-            for record in records:
-                flat_record = record["fields"]
-                flat_record["airtable_id"] = record["id"]
-                flattened_records.append(flat_record)
-            return flattened_records
+        # Skip the response cache (read and write) for this request only, so the
+        # check always reaches Airtable; cache_disabled() would affect every
+        # session's thread sharing this session
+        response = _get_session().get(
+            AIRTABLE_ENDPOINT,
+            params={"maxRecords": 1, "fields[]": "Age"},
+            timeout=5,
+            headers={"Cache-Control": "no-store"}
+        )
+        return response.status_code == 200
+    except requests.RequestException:
+        return False
+
+def _invalidate_record_cache():
+    """Drop cached reads after a write"""
+    _get_session().cache.clear()
+    _fetch_records.clear()
+
+def _write_through_cached_records(added=(), deleted_ids=()):
+    """Apply a successful write to this session's cached DataFrame"""
+    df = st.session_state.get("cached_df")
+    if df is None:
+        return
+    if added:
+        df = _apply_dtypes(pd.concat([df, _page_to_frame(list(added))], ignore_index=True))
+    if deleted_ids:
+        df = df[~df["airtable_id"].isin(deleted_ids)].reset_index(drop=True)
+    st.session_state["cached_df"] = df
+
+# Airtable accepts up to 10 records per write request; batches are sent
+# concurrently and paced by the session's adapter
+_BATCH_SIZE = 10
+_MAX_WORKERS = 5
+
+def _chunks(items):
+    """Split a list into Airtable-sized batches"""
+    return [items[i:i + _BATCH_SIZE] for i in range(0, len(items), _BATCH_SIZE)]
+
+# Pre-encoded JSON envelope for write bodies: {"records":[{"fields":...},...]}
+_RECORDS_PRE = b'{"records":['
+_RECORDS_POST = b']}'
+_FIELDS_PRE = b'{"fields":'
+_ID_PRE = b'{"id":'
+_ID_FIELDS_SEP = b',"fields":'
+_RECORD_POST = b'}'
+
+def _records_body(encoded_records):
+    """Wrap already-encoded record objects in the records envelope"""
+    return _RECORDS_PRE + b",".join(encoded_records) + _RECORDS_POST
+
+def _send_batches(method, requests_kwargs):
+    """Send one request per batch concurrently.
+    
+    Returns, in batch order, each batch's response or the exception it raised,
+    so one failed batch never hides the outcome of the others.
+    """
+    session = _get_session()
+    with ThreadPoolExecutor(max_workers=_MAX_WORKERS) as executor:
+        futures = [
+            executor.submit(session.request, method, AIRTABLE_ENDPOINT, timeout=_REQUEST_TIMEOUT, **kwargs)
+            for kwargs in requests_kwargs
+        ]
+    
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as e:
+            results.append(e)
+    return results
+
+def _batch_records(results):
+    """Yield the records returned by successful batches, reporting failed ones"""
+    for result in results:
+        if isinstance(result, Exception):
+            st.error(f"Error: {result}")
+        elif result.status_code == 200:
+            yield from orjson.loads(result.content)["records"]
         else:
-            st.error(f"Airtable API error: {response.text}")
-            return []
+            st.error(f"Airtable API error: {result.text}")
+
+def add_records_to_airtable(records):
+    """Add records to Airtable; returns the created records (id + fields)"""
+    batches = [
+        {"data": _records_body(_FIELDS_PRE + orjson.dumps(fields) + _RECORD_POST for fields in chunk)}
+        for chunk in _chunks(records)
+    ]
+    
+    created = []
+    try:
+        for record in _batch_records(_send_batches("POST", batches)):
+            created.append(record)
     except Exception as e:
         st.error(f"Error: {e}")
-        return []
-
-def update_airtable_record(record_id, updates):
-    """Update record in Airtable"""
-    headers = {
-        "Authorization": f"Bearer {AIRTABLE_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    
-    data = {
-        "records": [
-            {
-                "id": record_id,
-                "fields": updates
-            }
-        ]
-    }
+    finally:
+        if created:
+            _invalidate_record_cache()
+            _write_through_cached_records(added=created)
+    return created
+
+def update_records(pairs):
+    """Update records in Airtable from (record_id, fields) pairs"""
+    batches = [
+        {"data": _records_body(
+            _ID_PRE + orjson.dumps(record_id) + _ID_FIELDS_SEP + orjson.dumps(fields) + _RECORD_POST
+            for record_id, fields in chunk
+        )}
+        for chunk in _chunks(pairs)
+    ]
     
+    updated_ids = []
     try:
-        response = requests.patch(AIRTABLE_ENDPOINT, json=data, headers=headers)
-        return response.status_code == 200
+        for record in _batch_records(_send_batches("PATCH", batches)):
+            updated_ids.append(record["id"])
     except Exception as e:
         st.error(f"Error: {e}")
-        return False
+    finally:
+        if updated_ids:
+            _invalidate_record_cache()
+            st.session_state.pop("cached_df", None)
+    return len(updated_ids) == len(pairs)
 
-def delete_airtable_record(record_id):
-    """Delete record from Airtable"""
-    headers = {
-        "Authorization": f"Bearer {AIRTABLE_API_KEY}"
-    }
+def delete_records(record_ids):
+    """Delete records from Airtable"""
+    batches = [{"params": {"records[]": chunk}} for chunk in _chunks(record_ids)]
     
+    deleted_ids = []
     try:
-        response = requests.delete(f"{AIRTABLE_ENDPOINT}/{record_id}", headers=headers)
-        return response.status_code == 200
+        for record in _batch_records(_send_batches("DELETE", batches)):
+            deleted_ids.append(record["id"])
     except Exception as e:
         st.error(f"Error: {e}")
-        return False
+    finally:
+        if deleted_ids:
+            _invalidate_record_cache()
+            _write_through_cached_records(deleted_ids=deleted_ids)
+    return len(deleted_ids) == len(record_ids)
 
 # Streamlit UI
 st.title("🗃️ Airtable Database Integration")
@@ -159,11 +441,8 @@ with st.expander("🚀 Super Easy Airtable Setup (5 minutes!)"):
 
 # Test connection
 if st.button("🔍 Test Airtable Connection"):
-    records = get_records_from_airtable()
-    if records is not None:
-        st.success(f"✅ Connected! Found {len(records)} records")
-        if records:
-            st.dataframe(pd.DataFrame(records))
+    if ping_airtable():
+        st.success("✅ Connected! Credentials and table look good")
     else:
         st.error("❌ Connection failed. Check your credentials.")
 
@@ -178,34 +457,31 @@ with tab1:
         
         with col1:
             age = st.number_input("Age", min_value=18, max_value=90, value=65)
-            gender = st.selectbox("Gender", ["Male", "Female"])
-            species = st.selectbox("Species", [
-                "E. coli", "Klebsiella spp.", "Proteus spp.", 
-                "Pseudomonas spp.", "Acinetobacter spp."
-            ])
-            rectal_cpe = st.selectbox("Rectal CPE Positive", ["0", "1"])
-            setting = st.selectbox("Setting", ["ICU", "Internal Medicine"])
-            acquisition = st.selectbox("Acquisition", ["Community", "Hospital"])
+            gender = st.selectbox("Gender", _GENDER)
+            species = st.selectbox("Species", _SPECIES)
+            rectal_cpe = st.selectbox("Rectal CPE Positive", _BINARY)
+            setting = st.selectbox("Setting", _SETTING)
+            acquisition = st.selectbox("Acquisition", _ACQUISITION)
         
         with col2:
-            bsi_source = st.selectbox("BSI Source", ["Primary", "Lung", "Abdomen", "UTI"])
-            chf = st.selectbox("CHF", ["0", "1"])
-            ckd = st.selectbox("CKD", ["0", "1"])
-            tumor = st.selectbox("Tumor", ["0", "1"])
-            diabetes = st.selectbox("Diabetes", ["0", "1"])
-            immunosuppressed = st.selectbox("Immunosuppressed", ["0", "1"])
+            bsi_source = st.selectbox("BSI Source", _BSI_SOURCE)
+            chf = st.selectbox("CHF", _BINARY)
+            ckd = st.selectbox("CKD", _BINARY)
+            tumor = st.selectbox("Tumor", _BINARY)
+            diabetes = st.selectbox("Diabetes", _BINARY)
+            immunosuppressed = st.selectbox("Immunosuppressed", _BINARY)
         
         # Resistance outcomes
         st.subheader("🧪 Resistance Results")
         col3, col4 = st.columns(2)
         
         with col3:
-            cr = st.selectbox("CR (Carbapenem Resistance)", ["0", "1"])
-            blbli_r = st.selectbox("BLBLI_R", ["0", "1"])
+            cr = st.selectbox("CR (Carbapenem Resistance)", _BINARY)
+            blbli_r = st.selectbox("BLBLI_R", _BINARY)
         
         with col4:
-            fqr = st.selectbox("FQR", ["0", "1"]) 
-            gc3_r = st.selectbox("3GC_R", ["0", "1"])
+            fqr = st.selectbox("FQR", _BINARY) 
+            gc3_r = st.selectbox("3GC_R", _BINARY)
         
         notes = st.text_area("Notes (optional)")
         
@@ -228,50 +504,56 @@ with tab1:
                 "FQR": fqr,
                 "GC3_R": gc3_r,
                 "Notes": notes,
-                "Created_At": datetime.datetime.now().strftime("%Y-%m-%d")
+                "Created_At": datetime.date.today().isoformat()
             }
             
-            record_id = add_record_to_airtable(record_data)
-            if record_id:
-                st.success(f"✅ Record saved successfully! ID: {record_id}")
+            created = add_records_to_airtable([record_data])
+            if created:
+                st.success(f"✅ Record saved successfully! ID: {created[0]['id']}")
                 st.balloons()
             else:
                 st.error("❌ Failed to save record")
 
-with tab2:
+@st.fragment
+def _render_view_tab():
+    """View Data tab; reruns on its own widgets without rerunning the whole app"""
     st.header("📊 View All Records")
     
-    records = get_records_from_airtable()
+    df = get_records_from_airtable()
     
-    if records:
-        df = pd.DataFrame(records)
+    if not df.empty:
+        df_key = _frame_key(df)
+        summary = _summarize_records(df, df_key)
         
         # Display metrics
         col1, col2, col3 = st.columns(3)
         with col1:
             st.metric("Total Records", len(df))
         with col2:
-            if 'Gender' in df.columns:
-                male_count = len(df[df['Gender'] == 'Male'])
-                st.metric("Male Patients", male_count)
+            if "male_count" in summary:
+                st.metric("Male Patients", summary["male_count"])
         with col3:
-            if 'Gender' in df.columns:
-                female_count = len(df[df['Gender'] == 'Female'])
-                st.metric("Female Patients", female_count)
+            if "female_count" in summary:
+                st.metric("Female Patients", summary["female_count"])
         
         # Data table
         st.subheader("All Patient Records")
         st.dataframe(df, use_container_width=True)
         
         # Export functionality
-        if st.button("📥 Export to CSV"):
-            csv = df.to_csv(index=False)
+        if st.button("📥 Export Data"):
             st.download_button(
                 label="Download CSV File",
-                data=csv,
+                data=_df_to_csv_bytes(df, df_key),
                 file_name=f"patient_data_{datetime.date.today()}.csv",
                 mime="text/csv"
             )
+            st.download_button(
+                label="Download Parquet File",
+                data=_df_to_parquet_bytes(df, df_key),
+                file_name=f"patient_data_{datetime.date.today()}.parquet",
+                mime="application/octet-stream"
+            )
         
         # Quick analytics
         st.subheader("📈 Quick Analytics")
@@ -280,33 +562,31 @@ with tab2:
         
         with col1:
             if 'Species' in df.columns:
-                species_counts = df['Species'].value_counts()
                 st.write("**Species Distribution:**")
-                st.bar_chart(species_counts)
+                st.bar_chart(df['Species'].value_counts())
         
         with col2:
             # Resistance summary
-            resistance_cols = ['CR', 'BLBLI_R', 'FQR', 'GC3_R']
-            available_cols = [col for col in resistance_cols if col in df.columns]
-            
-            if available_cols:
-                resistance_data = {}
-                for col in available_cols:
-                    resistance_data[col] = (df[col] == '1').sum()
-                
+            if "resistance" in summary:
                 st.write("**Resistance Patterns:**")
-                st.bar_chart(pd.Series(resistance_data))
+                st.bar_chart(summary["resistance"])
     
     else:
         st.info("No records found. Add some data in the 'Add Record' tab!")
 
+with tab2:
+    _render_view_tab()
+
 # Requirements file content
 st.markdown("---")
 st.code("""
 # requirements.txt
-streamlit
+streamlit>=1.37
 pandas
 requests
+requests-cache
+pyarrow
+orjson
 """)
 
 # Deployment checklist